@@ -1,2 +1,2 @@
 
-from .evaluate import evaluate, evaluate_h5_model
+from .evaluate import evaluate, evaluate_h5_model, evaluate_tflite_model
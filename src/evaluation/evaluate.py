@@ -1,6 +1,7 @@
 
 import os
 import sys
+import functools
 from pathlib import Path
 import warnings
 import sklearn
@@ -15,8 +16,125 @@ import tensorflow as tf
 import tqdm
 from typing import Optional
 
-from common.utils import plot_confusion_matrix, log_to_file, compute_confusion_matrix, count_h5_parameters
-from src.utils import get_loss
+from common.utils import plot_confusion_matrix, log_to_file, count_h5_parameters
+from src.utils import get_loss, fold_conv_bn
+
+
+def _to_class_ids(t: tf.Tensor) -> tf.Tensor:
+    """
+    Converts one-hot labels or softmax scores to class ids, and binary labels or sigmoid scores to 0/1.
+
+    Args:
+        t (tf.Tensor): A batch of labels or model outputs of shape (batch_size, n_outputs).
+    Returns:
+        tf.Tensor: The class ids of shape (batch_size,).
+    """
+    if t.shape[-1] > 1:
+        return tf.argmax(t, axis=-1)
+    return tf.cast(tf.cast(t[:, 0], tf.float32) >= 0.5, tf.int64)
+
+
+def _prepare_eval_ds(eval_ds: tf.data.Dataset = None) -> tf.data.Dataset:
+    """
+    Prefetches the evaluation dataset so that the input pipeline overlaps with the model execution.
+
+    Args:
+        eval_ds (tf.data.Dataset): The test data to evaluate the model on.
+    Returns:
+        tf.data.Dataset: The prefetched dataset.
+    """
+    # The order of the batches does not matter for the evaluation metrics
+    options = tf.data.Options()
+    options.deterministic = False
+    options.experimental_optimization.map_parallelization = True
+    eval_ds = eval_ds.with_options(options)
+    eval_ds = eval_ds.prefetch(tf.data.AUTOTUNE)
+    return eval_ds
+
+
+def _single_pass_metrics(eval_ds: tf.data.Dataset = None, step_fn=None, num_classes: int = None) -> tuple:
+    """
+    Runs the inference once over the dataset and accumulates the loss and the confusion matrix.
+
+    Args:
+        eval_ds (tf.data.Dataset): The test data to evaluate the model on.
+        step_fn (callable): A function mapping a batch (x, y) to the batch loss and the model outputs.
+        num_classes (int): The number of classes.
+    Returns:
+        tuple: The loss, the accuracy in percent and the confusion matrix as a numpy array.
+    """
+    loss_metric = tf.keras.metrics.Mean()
+    cm = tf.Variable(tf.zeros((num_classes, num_classes), dtype=tf.int64), trainable=False)
+    for x, y in eval_ds:
+        batch_loss, preds = step_fn(x, y)
+        loss_metric.update_state(batch_loss, sample_weight=tf.shape(x)[0])
+        cm.assign_add(tf.math.confusion_matrix(_to_class_ids(y), _to_class_ids(preds),
+                                               num_classes=num_classes, dtype=tf.int64))
+    cm = cm.numpy()
+    test_accuracy = round(float(np.trace(cm) / np.sum(cm)) * 100, 2)
+    return float(loss_metric.result()), test_accuracy, cm
+
+
+@functools.lru_cache(maxsize=4)
+def _make_eval_graph(model_config: str = None, x_shape: tuple = None, y_shape: tuple = None,
+                     num_classes: int = None) -> tuple:
+    """
+    Builds an XLA-compiled evaluation step for a model architecture and fixed input and label shapes.
+    The returned model only holds the weights: loading another checkpoint of the same architecture
+    into it reuses the traced and compiled graph instead of building a new one.
+
+    Args:
+        model_config (str): The JSON architecture of the model.
+        x_shape (tuple): The shape of an input batch.
+        y_shape (tuple): The shape of a label batch.
+        num_classes (int): The number of classes.
+    Returns:
+        tuple: The weight-holder model and the step function mapping a batch (x, y) to the batch loss
+        and the model outputs.
+    """
+    model = tf.keras.models.model_from_json(model_config)
+    loss = get_loss(num_classes=num_classes)
+
+    @tf.function(jit_compile=True,
+                 input_signature=[tf.TensorSpec(x_shape, tf.float32), tf.TensorSpec(y_shape, tf.float32)])
+    def xla_step(x, y):
+        preds = model(x, training=False)
+        return loss(y, preds), preds
+
+    return model, xla_step
+
+
+def _make_keras_step(model: tf.keras.Model = None, num_classes: int = None):
+    """
+    Builds a step function mapping a batch (x, y) to the batch loss and the model outputs.
+    Batches of the steady-state size run through an XLA-compiled graph shared by all the models
+    of the same architecture, any other batch size (the last partial batch) runs eagerly
+    so that XLA compiles a single time.
+
+    Args:
+        model (tf.keras.Model): The Keras model.
+        num_classes (int): The number of classes.
+    Returns:
+        callable: The step function.
+    """
+    loss = get_loss(num_classes=num_classes)
+    xla_step = None
+    batch_size = None
+
+    def step(x, y):
+        nonlocal xla_step, batch_size
+        if xla_step is None:
+            # The first batch fixes the shape of the compiled graph
+            batch_size = x.shape[0]
+            graph_model, xla_step = _make_eval_graph(model_config=model.to_json(), x_shape=tuple(x.shape),
+                                                     y_shape=tuple(y.shape), num_classes=num_classes)
+            graph_model.set_weights(model.get_weights())
+        if x.shape[0] == batch_size:
+            return xla_step(tf.cast(x, tf.float32), tf.cast(y, tf.float32))
+        preds = model.predict_on_batch(x)
+        return loss(y, preds), preds
+
+    return step
 
 
 def evaluate_h5_model(model_path: str = None, eval_ds: tf.data.Dataset = None, class_names: list = None,
@@ -34,36 +152,135 @@ def evaluate_h5_model(model_path: str = None, eval_ds: tf.data.Dataset = None, c
         float: The accuracy of the model on the test data.
     """
 
-    # Load the .h5 model
-    model = tf.keras.models.load_model(model_path)
-    loss = get_loss(num_classes=len(class_names))
-    model.compile(loss=loss, metrics=['accuracy'])
+    # Load the .h5 model and fold its BatchNormalization layers into the preceding convolutions
+    model = tf.keras.models.load_model(model_path, compile=False)
+    model = fold_conv_bn(model)
 
-    # Evaluate the model on the test data
+    # No model.compile: the loss is computed in the XLA step, which fuses the elementwise ops
+    # into the conv/dense kernels
+    step = _make_keras_step(model=model, num_classes=len(class_names))
+
+    # Evaluate the model on the test data, loss and confusion matrix in a single pass
+    eval_ds = _prepare_eval_ds(eval_ds)
     tf.print(f'[INFO] : Evaluating the float model using {name_ds}...')
-    test_loss, test_accuracy = model.evaluate(eval_ds)
-    cm, test_accuracy = compute_confusion_matrix(test_set=eval_ds, model=model)
+    test_loss, test_accuracy, cm = _single_pass_metrics(eval_ds=eval_ds, step_fn=step,
+                                                        num_classes=len(class_names))
+
+    _log_results(cm=cm, test_loss=test_loss, test_accuracy=test_accuracy, class_names=class_names,
+                 output_dir=output_dir, name_ds=name_ds, model_type="float")
+    return test_accuracy
+
+
+def _make_tflite_step(interpreter: tf.lite.Interpreter = None, loss: tf.keras.losses.Loss = None):
+    """
+    Wraps a TensorFlow Lite interpreter into a step function mapping a batch (x, y) to the batch loss
+    and the dequantized model outputs.
+
+    Args:
+        interpreter (tf.lite.Interpreter): The interpreter of the .tflite model.
+        loss (tf.keras.losses.Loss): The loss function.
+    Returns:
+        callable: The step function.
+    """
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+    input_scale, input_zero_point = input_details['quantization']
+    output_scale, output_zero_point = output_details['quantization']
+    input_shape = None
+
+    def step(x, y):
+        nonlocal input_shape
+        x = x.numpy().astype(np.float32)
+        if input_scale:
+            iinfo = np.iinfo(input_details['dtype'])
+            x = np.clip(np.rint(x / input_scale + input_zero_point), iinfo.min, iinfo.max)
+        x = x.astype(input_details['dtype'])
 
+        # Resize only when the batch size changes (last batch)
+        if x.shape != input_shape:
+            interpreter.resize_tensor_input(input_details['index'], x.shape)
+            interpreter.allocate_tensors()
+            input_shape = x.shape
+        interpreter.set_tensor(input_details['index'], x)
+        interpreter.invoke()
+
+        preds = interpreter.get_tensor(output_details['index']).astype(np.float32)
+        if output_scale:
+            preds = (preds - output_zero_point) * output_scale
+        preds = tf.convert_to_tensor(preds)
+        return loss(y, preds), preds
+
+    return step
+
+
+def evaluate_tflite_model(model_path: str = None, eval_ds: tf.data.Dataset = None, class_names: list = None,
+                          output_dir: str = None, name_ds: Optional[str] = 'test_set',
+                          num_threads: Optional[int] = None) -> float:
+    """
+    Evaluates a quantized TensorFlow Lite model on the provided test data.
+
+    Args:
+        model_path (str): The file path to the .tflite model.
+        eval_ds (tf.data.Dataset): The test data to evaluate the model on.
+        class_names (list): A list of class names for the confusion matrix.
+        output_dir (str): The directory where to save the image.
+        name_ds (str): The name of the chosen eval_ds to be mentioned in the prints and figures.
+        num_threads (int, optional): The number of threads used by the interpreter.
+    Returns:
+        float: The accuracy of the model on the test data.
+    """
+
+    # Load the .tflite model
+    interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+    loss = get_loss(num_classes=len(class_names))
+    step = _make_tflite_step(interpreter=interpreter, loss=loss)
+
+    # Evaluate the model on the test data, loss and confusion matrix in a single pass
+    eval_ds = _prepare_eval_ds(eval_ds)
+    tf.print(f'[INFO] : Evaluating the quantized model using {name_ds}...')
+    test_loss, test_accuracy, cm = _single_pass_metrics(eval_ds=eval_ds, step_fn=step,
+                                                        num_classes=len(class_names))
+
+    _log_results(cm=cm, test_loss=test_loss, test_accuracy=test_accuracy, class_names=class_names,
+                 output_dir=output_dir, name_ds=name_ds, model_type="quantized")
+    return test_accuracy
+
+
+def _log_results(cm: np.ndarray = None, test_loss: float = None, test_accuracy: float = None,
+                 class_names: list = None, output_dir: str = None, name_ds: str = None,
+                 model_type: str = "float") -> None:
+    """
+    Plots the confusion matrix and logs the accuracy and the loss of an evaluated model.
+
+    Args:
+        cm (np.ndarray): The confusion matrix.
+        test_loss (float): The loss of the model.
+        test_accuracy (float): The accuracy of the model in percent.
+        class_names (list): A list of class names for the confusion matrix.
+        output_dir (str): The directory where to save the image.
+        name_ds (str): The name of the evaluated dataset.
+        model_type (str): The type of the evaluated model, "float" or "quantized".
+    Returns:
+        None
+    """
     # Log the confusion matrix as an image summary.
-    # test_accuracy = round(test_accuracy * 100, 2)
-    model_name = f"float_model_confusion_matrix_{name_ds}"
+    model_name = f"{model_type}_model_confusion_matrix_{name_ds}"
     plot_confusion_matrix(cm=cm, class_names=class_names, model_name=model_name,
                           title=f'{model_name}\n accuracy: {test_accuracy} %', output_dir=output_dir)
     
-    print(f"[INFO] : Accuracy of float model = {test_accuracy} %")
-    print(f"[INFO] : Loss of float model = {test_loss}")
-    mlflow.log_metric(f"float_acc_{name_ds}", test_accuracy)
-    mlflow.log_metric(f"float_loss_{name_ds}", test_loss)
-    log_to_file(output_dir, f"Float model {name_ds}:")
-    log_to_file(output_dir, f"Accuracy of float model : {test_accuracy} %")
-    log_to_file(output_dir, f"Loss of float model : {round(test_loss,2)} ")
-    return test_accuracy
+    print(f"[INFO] : Accuracy of {model_type} model = {test_accuracy} %")
+    print(f"[INFO] : Loss of {model_type} model = {test_loss}")
+    mlflow.log_metric(f"{model_type}_acc_{name_ds}", test_accuracy)
+    mlflow.log_metric(f"{model_type}_loss_{name_ds}", test_loss)
+    log_to_file(output_dir, f"{model_type.capitalize()} model {name_ds}:")
+    log_to_file(output_dir, f"Accuracy of {model_type} model : {test_accuracy} %")
+    log_to_file(output_dir, f"Loss of {model_type} model : {round(test_loss,2)} ")
 
 
 def evaluate(cfg: DictConfig = None, eval_ds: tf.data.Dataset = None,
              model_path_to_evaluate: Optional[str] = None, name_ds: Optional[str] = 'test_set') -> None:
     """
-    Evaluates and benchmarks a Keras model, and generates a Config header file if specified.
+    Evaluates a Keras (.h5) or a quantized TensorFlow Lite (.tflite) model.
 
     Args:
         cfg (config): The configuration file.
@@ -88,5 +305,10 @@ def evaluate(cfg: DictConfig = None, eval_ds: tf.data.Dataset = None,
             # Evaluate Keras model
             evaluate_h5_model(model_path=model_path, eval_ds=eval_ds,
                               class_names=class_names, output_dir=output_dir, name_ds=name_ds)
+        elif file_extension == '.tflite':
+            # Evaluate quantized TensorFlow Lite model
+            evaluate_tflite_model(model_path=model_path, eval_ds=eval_ds,
+                                  class_names=class_names, output_dir=output_dir, name_ds=name_ds,
+                                  num_threads=cfg.general.num_threads_tflite)
     except Exception:
         raise ValueError(f"Model accuracy evaluation failed\nReceived model path: {model_path}")
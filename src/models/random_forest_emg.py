@@ -4,13 +4,30 @@ Random Forest model for sEMG-based hand gesture recognition.
 Optimized for embedded deployment on STM32 microcontrollers.
 """
 
+from functools import lru_cache
 import numpy as np
+from scipy import fft as sp_fft
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import cross_val_score, StratifiedKFold
 from typing import Dict, Tuple, Optional
-import pickle
+import joblib
 import struct
 
+# Numba is optional, the feature extractors fall back to NumPy without it
+try:
+    from numba import njit, prange
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+
+# LZ4 is the fastest joblib compressor but needs the optional lz4 package
+try:
+    import lz4  # noqa: F401
+    _MODEL_COMPRESSION = ('lz4', 3)
+except ImportError:
+    _MODEL_COMPRESSION = ('zlib', 3)
+
 
 class RandomForestEMG:
     """
@@ -74,9 +91,13 @@ class RandomForestEMG:
         # Train model
         self.model.fit(X_train, y_train)
         
-        # Cross-validation
+        # Cross-validation, folds are fitted concurrently with single-threaded
+        # forests to avoid oversubscribing the cores (folds x trees)
         cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
-        cv_scores = cross_val_score(self.model, X_train, y_train, cv=cv, scoring='accuracy')
+        splits = list(cv.split(X_train, y_train))
+        cv_estimator = clone(self.model).set_params(n_jobs=1)
+        cv_scores = cross_val_score(cv_estimator, X_train, y_train, cv=splits, scoring='accuracy',
+                                    n_jobs=-1, pre_dispatch='2*n_jobs')
         
         # Get feature importance
         feature_importance = self.model.feature_importances_
@@ -100,13 +121,16 @@ class RandomForestEMG:
             
         Returns:
             predictions: Predicted classes
-            confidences: Confidence scores (0-100%)
+            confidences: Confidence scores (0-100%, uint8)
         """
+        # Trees are evaluated on contiguous float32, cast once instead of inside each sklearn call
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        
         predictions = self.model.predict(X)
         
         # Get prediction probabilities for confidence
         probabilities = self.model.predict_proba(X)
-        confidences = (np.max(probabilities, axis=1) * 100).astype(int)
+        confidences = np.rint(probabilities.max(axis=1) * 100).astype(np.uint8)
         
         return predictions, confidences
     
@@ -152,83 +176,87 @@ class RandomForestEMG:
             filepath: Output file path
             model_name: Name for the model variable
         """
-        with open(filepath, 'w') as f:
-            # Write header guard
-            f.write(f"#ifndef {model_name.upper()}_H\n")
-            f.write(f"#define {model_name.upper()}_H\n\n")
-            
-            # Write includes
-            f.write('#include <stdint.h>\n')
-            f.write('#include "random_forest.h"\n\n')
-            
-            # Write model parameters
-            f.write(f"// Model: {model_name}\n")
-            f.write(f"// Trees: {len(self.model.estimators_)}\n")
-            f.write(f"// Features: {self.n_features}\n")
-            f.write(f"// Classes: {self.n_classes}\n\n")
-            
-            # Write feature normalization parameters (placeholder)
-            f.write("// Feature normalization parameters (Q8.8 format)\n")
-            f.write(f"const fixed_point_t {model_name}_feature_scale[{self.n_features}] = {{\n")
-            for i in range(self.n_features):
-                f.write(f"    256,  // Feature {i}\n")
-            f.write("};\n\n")
-            
-            f.write(f"const fixed_point_t {model_name}_feature_offset[{self.n_features}] = {{\n")
-            for i in range(self.n_features):
-                f.write(f"    0,  // Feature {i}\n")
-            f.write("};\n\n")
-            
-            # Write tree data
-            f.write(f"// Random Forest model data\n")
-            f.write(f"const RF_Model_t {model_name} = {{\n")
-            f.write(f"    .n_trees = {len(self.model.estimators_)},\n")
-            f.write(f"    .n_features = {self.n_features},\n")
-            f.write(f"    .n_classes = {self.n_classes},\n")
-            f.write("    .trees = {\n")
-            
-            # Export each tree
-            for tree_idx, estimator in enumerate(self.model.estimators_):
-                tree = estimator.tree_
-                f.write(f"        {{ // Tree {tree_idx}\n")
-                f.write("            .nodes = {\n")
-                
-                # Export nodes
-                for node_idx in range(tree.node_count):
-                    if tree.feature[node_idx] >= 0:  # Internal node
-                        feature = tree.feature[node_idx]
-                        threshold = int(tree.threshold[node_idx] * 256)  # Convert to Q8.8
-                        left = tree.children_left[node_idx]
-                        right = tree.children_right[node_idx]
-                        
-                        f.write(f"                {{{feature}, 0x00, {threshold}, "
-                               f"{left}, {right}, {{0, 0}}}},\n")
-                    else:  # Leaf node
-                        class_label = np.argmax(tree.value[node_idx])
-                        f.write(f"                {{0, 0x80 | {class_label}, 0, "
-                               f"0, 0, {{0, 0}}}},\n")
-                
-                f.write("            },\n")
-                f.write(f"            .n_nodes = {tree.node_count},\n")
-                f.write("            .root_idx = 0\n")
-                f.write("        },\n")
+        n_trees = len(self.model.estimators_)
+        guard = f"{model_name.upper()}_H"
+        
+        # Header guard, includes and model parameters
+        parts = [
+            f"#ifndef {guard}\n"
+            f"#define {guard}\n\n"
+            '#include <stdint.h>\n'
+            '#include "random_forest.h"\n\n'
+            f"// Model: {model_name}\n"
+            f"// Trees: {n_trees}\n"
+            f"// Features: {self.n_features}\n"
+            f"// Classes: {self.n_classes}\n\n"
+        ]
+        
+        # Feature normalization parameters (placeholder)
+        parts.append("// Feature normalization parameters (Q8.8 format)\n")
+        parts.append(f"const fixed_point_t {model_name}_feature_scale[{self.n_features}] = {{\n")
+        parts.extend(f"    256,  // Feature {i}\n" for i in range(self.n_features))
+        parts.append("};\n\n")
+        
+        parts.append(f"const fixed_point_t {model_name}_feature_offset[{self.n_features}] = {{\n")
+        parts.extend(f"    0,  // Feature {i}\n" for i in range(self.n_features))
+        parts.append("};\n\n")
+        
+        # Tree data
+        parts.append(
+            "// Random Forest model data\n"
+            f"const RF_Model_t {model_name} = {{\n"
+            f"    .n_trees = {n_trees},\n"
+            f"    .n_features = {self.n_features},\n"
+            f"    .n_classes = {self.n_classes},\n"
+            "    .trees = {\n"
+        )
+        
+        internal_fmt = "                {{{0}, 0x00, {1}, {2}, {3}, {{0, 0}}}},".format
+        leaf_fmt = "                {{0, 0x80 | {0}, 0, 0, 0, {{0, 0}}}},".format
+        
+        # Export each tree, all node arrays converted once per tree
+        for tree_idx, estimator in enumerate(self.model.estimators_):
+            tree = estimator.tree_
+            is_internal = (tree.feature >= 0).tolist()
+            feature = tree.feature.tolist()
+            # Convert to Q8.8, saturating to the int16 range of fixed_point_t
+            threshold = np.clip(np.rint(tree.threshold * 256.0), -32768, 32767).astype(np.int16).tolist()
+            left = tree.children_left.tolist()
+            right = tree.children_right.tolist()
+            leaf_class = tree.value.squeeze(1).argmax(axis=1).astype(np.uint8).tolist()
             
-            f.write("    }\n")
-            f.write("};\n\n")
+            node_lines = [
+                internal_fmt(feat, thr, l, r) if internal else leaf_fmt(cls)
+                for internal, feat, thr, l, r, cls
+                in zip(is_internal, feature, threshold, left, right, leaf_class)
+            ]
             
-            # Write footer
-            f.write(f"#endif // {model_name.upper()}_H\n")
+            parts.append(f"        {{ // Tree {tree_idx}\n"
+                         "            .nodes = {\n")
+            parts.append("\n".join(node_lines))
+            parts.append("\n            },\n"
+                         f"            .n_nodes = {tree.node_count},\n"
+                         "            .root_idx = 0\n"
+                         "        },\n")
+        
+        parts.append("    }\n"
+                     "};\n\n")
+        
+        # Footer
+        parts.append(f"#endif // {guard}\n")
+        
+        # Single write of the whole header
+        with open(filepath, 'w', buffering=1 << 20) as f:
+            f.write("".join(parts))
     
     def save_model(self, filepath: str):
-        """Save model to pickle file."""
-        with open(filepath, 'wb') as f:
-            pickle.dump(self, f)
+        """Save model to a compressed joblib file."""
+        joblib.dump(self, filepath, compress=_MODEL_COMPRESSION)
     
     @staticmethod
     def load_model(filepath: str):
-        """Load model from pickle file."""
-        with open(filepath, 'rb') as f:
-            return pickle.load(f)
+        """Load model from a joblib file (plain pickle files are also accepted)."""
+        return joblib.load(filepath)
 
 
 def get_random_forest_model(num_classes: int = 3, 
@@ -262,74 +290,233 @@ def get_random_forest_model(num_classes: int = 3,
 
 
 # Feature extraction functions for EMG signals
-def extract_time_domain_features(signal: np.ndarray) -> Dict[str, float]:
+# Column order of the time-domain feature matrix
+TIME_DOMAIN_FEATURES = ('rms', 'mav', 'var', 'zc', 'ssc', 'wl')
+
+
+if _HAS_NUMBA:
+    # No on-disk cache: the cache file is tied to the module import path, and fastmath is
+    # left off so the results follow the NumPy fallback
+    @njit
+    def _td_features_kernel(signal, out):
+        """
+        Compute the time-domain features of one window in a single pass, without temporaries.
+        Samples are accumulated in float64 and the variance uses Welford's update, which
+        avoids the cancellation of E[x^2] - mean^2 on signals with a DC offset.
+        
+        Args:
+            signal: EMG window (window_len,)
+            out: Output row (6,) filled in TIME_DOMAIN_FEATURES order
+        """
+        n = signal.shape[0]
+        if n == 0:
+            # Same as the NumPy fallback: undefined statistics, no crossings
+            out[0] = np.nan
+            out[1] = np.nan
+            out[2] = np.nan
+            out[3] = 0
+            out[4] = 0
+            out[5] = 0
+            return
+        
+        mean = 0.0
+        m2 = 0.0
+        total_abs = 0.0
+        total_sq = 0.0
+        wl = 0.0
+        zc = 0
+        ssc = 0
+        prev = np.float64(signal[0])
+        prev_diff = 0.0
+        for i in range(n):
+            x = np.float64(signal[i])
+            total_abs += abs(x)
+            total_sq += x * x
+            delta = x - mean
+            mean += delta / (i + 1)
+            m2 += delta * (x - mean)
+            if i > 0:
+                # Difference taken in the input precision, as np.diff does; the callers
+                # convert integer windows to float64 so both backends see the same data
+                diff = np.float64(signal[i] - signal[i - 1])
+                wl += abs(diff)
+                if np.signbit(x) != np.signbit(prev):
+                    zc += 1
+                if i > 1 and np.signbit(diff) != np.signbit(prev_diff):
+                    ssc += 1
+                prev_diff = diff
+            prev = x
+        
+        out[0] = np.sqrt(total_sq / n)
+        out[1] = total_abs / n
+        out[2] = m2 / n
+        out[3] = zc
+        out[4] = ssc
+        out[5] = wl
+    
+    @njit(parallel=True)
+    def _td_features_batch_kernel(signals, out):
+        """
+        Compute the time-domain features of a batch of windows, one window per thread.
+        
+        Args:
+            signals: EMG windows (n_windows, window_len)
+            out: Feature matrix (n_windows, 6)
+        """
+        for w in prange(signals.shape[0]):
+            _td_features_kernel(signals[w], out[w])
+
+
+def extract_time_domain_features_batch(signals: np.ndarray) -> np.ndarray:
     """
-    Extract time-domain features from EMG signal.
+    Extract time-domain features from a batch of EMG windows.
     
     Args:
-        signal: EMG signal array
+        signals: EMG windows (n_windows, window_len)
         
     Returns:
-        Dictionary of features
+        Feature matrix (n_windows, 6) in TIME_DOMAIN_FEATURES order
     """
-    features = {}
+    signals = np.atleast_2d(signals)
+    # Raw ADC windows are integers: squares and differences would overflow/wrap in their dtype
+    if not np.issubdtype(signals.dtype, np.floating):
+        signals = signals.astype(np.float64)
+    features = np.empty((signals.shape[0], len(TIME_DOMAIN_FEATURES)), dtype=np.float32)
+    
+    if _HAS_NUMBA:
+        _td_features_batch_kernel(np.ascontiguousarray(signals), features)
+        return features
+    
+    diff_signals = np.diff(signals, axis=1)
     
     # RMS (Root Mean Square)
-    features['rms'] = np.sqrt(np.mean(signal**2))
+    features[:, 0] = np.sqrt(np.mean(signals * signals, axis=1))
     
     # MAV (Mean Absolute Value)
-    features['mav'] = np.mean(np.abs(signal))
+    features[:, 1] = np.mean(np.abs(signals), axis=1)
     
-    # VAR (Variance)
-    features['var'] = np.var(signal)
+    # VAR (Variance), accumulated in float64 like the Numba kernel
+    features[:, 2] = signals.var(axis=1, dtype=np.float64)
     
-    # ZC (Zero Crossings)
-    zero_crossings = np.where(np.diff(np.sign(signal)))[0]
-    features['zc'] = len(zero_crossings)
+    # ZC (Zero Crossings), sign changes counted on 1-byte sign bits of adjacent samples
+    sign_bits = np.signbit(signals)
+    features[:, 3] = np.count_nonzero(sign_bits[:, 1:] ^ sign_bits[:, :-1], axis=1)
     
     # SSC (Slope Sign Changes)
-    diff_signal = np.diff(signal)
-    ssc = np.where(np.diff(np.sign(diff_signal)))[0]
-    features['ssc'] = len(ssc)
+    slope_sign_bits = np.signbit(diff_signals)
+    features[:, 4] = np.count_nonzero(slope_sign_bits[:, 1:] ^ slope_sign_bits[:, :-1], axis=1)
     
     # WL (Waveform Length)
-    features['wl'] = np.sum(np.abs(np.diff(signal)))
+    features[:, 5] = np.sum(np.abs(diff_signals), axis=1)
     
     return features
 
 
-def extract_frequency_domain_features(signal: np.ndarray, 
-                                    fs: float = 1000.0) -> Dict[str, float]:
+def extract_time_domain_features(signal: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
     """
-    Extract frequency-domain features from EMG signal using FFT.
+    Extract time-domain features from EMG signal.
     
     Args:
         signal: EMG signal array
+        out: Optional preallocated (6,) float32 row to fill, e.g. reused
+            across windows in a streaming loop
+        
+    Returns:
+        Feature row (6,) in TIME_DOMAIN_FEATURES order
+    """
+    if out is None:
+        out = np.empty(len(TIME_DOMAIN_FEATURES), dtype=np.float32)
+    
+    if _HAS_NUMBA:
+        signal = np.ascontiguousarray(signal)
+        # Same float conversion of raw ADC windows as extract_time_domain_features_batch
+        if not np.issubdtype(signal.dtype, np.floating):
+            signal = signal.astype(np.float64)
+        _td_features_kernel(signal, out)
+    else:
+        out[:] = extract_time_domain_features_batch(np.atleast_2d(signal))[0]
+    return out
+
+
+# Column order of the frequency-domain feature matrix
+FREQUENCY_DOMAIN_FEATURES = ('mean_freq', 'median_freq',
+                             'band_power_0', 'band_power_1', 'band_power_2', 'band_power_3')
+
+# Band power edges in Hz (0-50Hz, 50-150Hz, 150-250Hz, 250-500Hz)
+FREQUENCY_BANDS = ((0, 50), (50, 150), (150, 250), (250, 500))
+
+
+@lru_cache(maxsize=8)
+def _spectral_layout(window_len: int, fs: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Frequency bins and band masks for a window length, computed once per (window_len, fs).
+    
+    Args:
+        window_len: Number of samples per window
+        fs: Sampling frequency
+        
+    Returns:
+        freqs: rfft bin frequencies (window_len // 2 + 1,)
+        band_masks: Band membership of each bin (n_bands, window_len // 2 + 1)
+    """
+    freqs = np.fft.rfftfreq(window_len, 1/fs)
+    band_masks = np.stack([(freqs >= low) & (freqs <= high) for low, high in FREQUENCY_BANDS])
+    freqs.setflags(write=False)
+    band_masks.setflags(write=False)
+    return freqs, band_masks
+
+
+def extract_frequency_domain_features_batch(signals: np.ndarray,
+                                            fs: float = 1000.0) -> np.ndarray:
+    """
+    Extract frequency-domain features from a batch of EMG windows using one FFT call.
+    
+    Args:
+        signals: EMG windows (n_windows, window_len)
         fs: Sampling frequency
         
     Returns:
-        Dictionary of features
+        Feature matrix (n_windows, 6) in FREQUENCY_DOMAIN_FEATURES order
     """
-    features = {}
+    signals = np.atleast_2d(signals)
+    freqs, band_masks = _spectral_layout(signals.shape[1], float(fs))
+    
+    # Compute FFT of all windows at once
+    psd = np.abs(sp_fft.rfft(signals, axis=-1, workers=-1))**2
     
-    # Compute FFT
-    fft = np.fft.rfft(signal)
-    freqs = np.fft.rfftfreq(len(signal), 1/fs)
-    magnitude = np.abs(fft)
-    psd = magnitude**2
+    features = np.empty((signals.shape[0], len(FREQUENCY_DOMAIN_FEATURES)), dtype=np.float32)
     
     # Mean frequency
-    features['mean_freq'] = np.sum(freqs * psd) / np.sum(psd)
+    features[:, 0] = (psd @ freqs) / psd.sum(axis=1)
     
     # Median frequency
-    cumsum = np.cumsum(psd)
-    median_idx = np.where(cumsum >= cumsum[-1] / 2)[0][0]
-    features['median_freq'] = freqs[median_idx]
+    cumsum = np.cumsum(psd, axis=1)
+    median_idx = (cumsum >= cumsum[:, -1:] / 2).argmax(axis=1)
+    features[:, 1] = freqs[median_idx]
     
-    # Band power (0-50Hz, 50-150Hz, 150-250Hz, 250-500Hz)
-    bands = [(0, 50), (50, 150), (150, 250), (250, 500)]
-    for i, (low, high) in enumerate(bands):
-        band_idx = np.logical_and(freqs >= low, freqs <= high)
-        features[f'band_power_{i}'] = np.sum(psd[band_idx])
+    # Band power
+    features[:, 2:] = psd @ band_masks.T.astype(psd.dtype)
+    
+    return features
+
+
+def extract_frequency_domain_features(signal: np.ndarray, 
+                                    fs: float = 1000.0,
+                                    out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Extract frequency-domain features from EMG signal using FFT.
+    
+    Args:
+        signal: EMG signal array
+        fs: Sampling frequency
+        out: Optional preallocated (6,) float32 row to fill, e.g. reused
+            across windows in a streaming loop
+        
+    Returns:
+        Feature row (6,) in FREQUENCY_DOMAIN_FEATURES order
+    """
+    if out is None:
+        out = np.empty(len(FREQUENCY_DOMAIN_FEATURES), dtype=np.float32)
     
-    return features
\ No newline at end of file
+    out[:] = extract_frequency_domain_features_batch(np.atleast_2d(signal), fs)[0]
+    return out
@@ -1,4 +1,4 @@
 
 from .parse_config import get_config
-from .models_mgt import get_model, get_loss
+from .models_mgt import get_model, get_loss, export_int8_tflite, fold_conv_bn
 from .gen_h_file import gen_h_user_file
@@ -6,6 +6,7 @@ import sys
 import os
 from pathlib import Path
 from typing import Tuple, Dict, Optional, List
+import numpy as np
 import tensorflow as tf
 from omegaconf import DictConfig
 
@@ -80,3 +81,164 @@ def get_loss(num_classes: int) -> tf.keras.losses:
     else:
         loss = tf.keras.losses.BinaryCrossentropy(from_logits=False)
     return loss
+
+
+def export_int8_tflite(model: tf.keras.Model = None, rep_ds: tf.data.Dataset = None, path: str = None,
+                       num_samples: int = 100) -> str:
+    """
+    Quantizes a Keras model to a full-integer (int8) TensorFlow Lite model.
+
+    Args:
+        model (tf.keras.Model): The float Keras model to quantize.
+        rep_ds (tf.data.Dataset): A batched (x, y) dataset used to calibrate the activation ranges.
+        path (str): The file path of the .tflite model to write.
+        num_samples (int): The number of samples of rep_ds used for the calibration.
+
+    Returns:
+        str: The file path of the .tflite model.
+    """
+    def representative_dataset():
+        for x, _ in rep_ds.unbatch().take(num_samples):
+            yield [tf.cast(x[tf.newaxis, ...], tf.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    tflite_model = converter.convert()
+
+    with open(path, "wb") as f:
+        f.write(tflite_model)
+    return path
+
+
+def _find_conv_bn_pairs(model: tf.keras.Model) -> Dict[str, tf.keras.layers.Layer]:
+    """
+    Finds the BatchNormalization layers that directly follow a convolution and can be folded into it.
+    The graph is walked through the layer input/output tensors, which Keras 2 and Keras 3 both expose.
+
+    Args:
+        model (tf.keras.Model): The Keras model.
+
+    Returns:
+        Dict[str, tf.keras.layers.Layer]: The BatchNormalization layers indexed by the name of their convolution.
+    """
+    conv_types = (tf.keras.layers.Conv2D, tf.keras.layers.DepthwiseConv2D, tf.keras.layers.SeparableConv2D)
+
+    # Producer and number of consumers of each symbolic tensor of the graph.
+    # Accessing the input/output of a layer called several times raises an error.
+    producers = {}
+    n_consumers = {}
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.InputLayer):
+            continue
+        for tensor in tf.nest.flatten(layer.output):
+            producers[id(tensor)] = layer
+        for tensor in tf.nest.flatten(layer.input):
+            n_consumers[id(tensor)] = n_consumers.get(id(tensor), 0) + 1
+    for tensor in tf.nest.flatten(model.outputs):
+        n_consumers[id(tensor)] = n_consumers.get(id(tensor), 0) + 1
+
+    pairs = {}
+    for layer in model.layers:
+        if not isinstance(layer, tf.keras.layers.BatchNormalization):
+            continue
+        bn_input = layer.input
+        conv = producers.get(id(bn_input))
+        rank = len(bn_input.shape)
+        axis = list(layer.axis) if isinstance(layer.axis, (list, tuple)) else [layer.axis]
+        # Only a channels-last BN fed by a linear, single-use convolution can be folded
+        if (isinstance(conv, conv_types)
+                and conv.get_config()["activation"] == "linear"
+                and n_consumers.get(id(bn_input)) == 1
+                and len(axis) == 1 and axis[0] in (-1, rank - 1)):
+            pairs[conv.name] = layer
+    return pairs
+
+
+def _fold_bn_weights(conv: tf.keras.layers.Layer, bn: tf.keras.layers.BatchNormalization) -> List[np.ndarray]:
+    """
+    Computes the weights of a convolution absorbing the BatchNormalization that follows it:
+    w' = w * gamma / sqrt(var + eps) and b' = (b - mean) * gamma / sqrt(var + eps) + beta.
+
+    Args:
+        conv (tf.keras.layers.Layer): The Conv2D, DepthwiseConv2D or SeparableConv2D layer.
+        bn (tf.keras.layers.BatchNormalization): The BatchNormalization layer.
+
+    Returns:
+        List[np.ndarray]: The weights of the folded convolution, bias included.
+    """
+    # BN weights are [gamma], [beta], moving_mean, moving_variance
+    bn_weights = bn.get_weights()
+    moving_mean, moving_variance = bn_weights[-2:]
+    n_channels = moving_mean.shape[0]
+    gamma = bn_weights[0] if bn.scale else np.ones(n_channels, dtype=np.float32)
+    beta = bn_weights[-3] if bn.center else np.zeros(n_channels, dtype=np.float32)
+    scale = gamma / np.sqrt(moving_variance + bn.epsilon)
+
+    weights = conv.get_weights()
+    bias = weights.pop() if conv.use_bias else np.zeros(n_channels, dtype=np.float32)
+    if isinstance(conv, tf.keras.layers.SeparableConv2D):
+        # The BN scales the output channels of the pointwise kernel
+        weights[1] = weights[1] * scale
+    elif isinstance(conv, tf.keras.layers.DepthwiseConv2D):
+        # Kernel is (h, w, in_channels, depth_multiplier), output channel = in_channel * depth_multiplier + m
+        weights[0] = weights[0] * scale.reshape(weights[0].shape[2:])
+    else:
+        weights[0] = weights[0] * scale
+    bias = (bias - moving_mean) * scale + beta
+    return weights + [bias]
+
+
+def fold_conv_bn(model: tf.keras.Model) -> tf.keras.Model:
+    """
+    Folds the BatchNormalization layers that follow a Conv2D, DepthwiseConv2D or SeparableConv2D
+    into the convolution weights and removes them from the model. The returned model is for inference
+    only and gives the same outputs with one elementwise op less per folded pair.
+
+    Args:
+        model (tf.keras.Model): The Keras model.
+
+    Returns:
+        tf.keras.Model: The model with the BatchNormalization layers folded, or the model itself
+        if there is nothing to fold or its graph cannot be analysed (e.g. shared layers).
+    """
+    try:
+        pairs = _find_conv_bn_pairs(model)
+        if not pairs:
+            return model
+        folded_bn_names = {bn.name for bn in pairs.values()}
+
+        # Rebuild the graph layer by layer (model.layers is in topological order),
+        # the folded BN layers are skipped by forwarding their input tensor
+        new_inputs = [tf.keras.Input(shape=t.shape[1:], dtype=t.dtype, name=t.name) for t in model.inputs]
+        tensor_map = {id(t): new_t for t, new_t in zip(model.inputs, new_inputs)}
+        new_layers = []
+        for layer in model.layers:
+            if isinstance(layer, tf.keras.layers.InputLayer):
+                continue
+            if layer.name in folded_bn_names:
+                tensor_map[id(layer.output)] = tensor_map[id(layer.input)]
+                continue
+            config = layer.get_config()
+            if layer.name in pairs:
+                # The folded convolution always needs a bias
+                config["use_bias"] = True
+            new_layer = layer.__class__.from_config(config)
+            outputs = new_layer(tf.nest.map_structure(lambda t: tensor_map[id(t)], layer.input))
+            for t, new_t in zip(tf.nest.flatten(layer.output), tf.nest.flatten(outputs)):
+                tensor_map[id(t)] = new_t
+            new_layers.append((layer, new_layer))
+        new_outputs = tf.nest.map_structure(lambda t: tensor_map[id(t)], model.outputs)
+    except (AttributeError, ValueError, TypeError, KeyError):
+        return model
+
+    folded_model = tf.keras.Model(inputs=new_inputs, outputs=new_outputs, name=model.name)
+    for layer, new_layer in new_layers:
+        if layer.name in pairs:
+            new_layer.set_weights(_fold_bn_weights(layer, pairs[layer.name]))
+        else:
+            new_layer.set_weights(layer.get_weights())
+    return folded_model
@@ -4,6 +4,9 @@ Turkish Sign Language (TSL) gesture dictionary for sEMG hand prosthesis.
 Maps gesture names to class IDs and servo positions.
 """
 
+from types import MappingProxyType
+from typing import Sequence
+
 # Initial 3-class gesture dictionary
 basic_gesture_dict = {
     "open_hand": 0,      # All fingers extended
@@ -107,6 +110,23 @@ confidence_thresholds = {
     "low": 40,           # Low confidence (training mode)
 }
 
+# Dictionary name -> mapping, resolved once at import time
+_GESTURE_REGISTRY = {
+    "basic": basic_gesture_dict,
+    "tsl": tsl_alphabet_dict,
+    "extended": extended_gesture_dict,
+}
+
+_SERVO_REGISTRY = {
+    "basic": basic_servo_positions,
+    "tsl": tsl_servo_positions,
+}
+
+_EMPTY = MappingProxyType({})
+
+# Neutral position [thumb, index, middle, ring, pinky, wrist]
+_DEFAULT_POS = (90,) * 6
+
 def get_gesture_id(gesture_name: str, dictionary: str = "basic") -> int:
     """
     Get gesture ID from name.
@@ -118,16 +138,9 @@ def get_gesture_id(gesture_name: str, dictionary: str = "basic") -> int:
     Returns:
         Gesture ID or -1 if not found
     """
-    if dictionary == "basic":
-        return basic_gesture_dict.get(gesture_name, -1)
-    elif dictionary == "tsl":
-        return tsl_alphabet_dict.get(gesture_name, -1)
-    elif dictionary == "extended":
-        return extended_gesture_dict.get(gesture_name, -1)
-    else:
-        return -1
-
-def get_servo_positions(gesture_name: str, dictionary: str = "basic") -> list:
+    return _GESTURE_REGISTRY.get(dictionary, _EMPTY).get(gesture_name, -1)
+
+def get_servo_positions(gesture_name: str, dictionary: str = "basic") -> Sequence[int]:
     """
     Get servo positions for a gesture.
     
@@ -136,14 +149,10 @@ def get_servo_positions(gesture_name: str, dictionary: str = "basic") -> list:
         dictionary: Which dictionary to use
         
     Returns:
-        List of 6 servo positions [thumb, index, middle, ring, pinky, wrist]
+        6 servo positions [thumb, index, middle, ring, pinky, wrist],
+        the neutral position tuple if the gesture has no mapping
     """
-    if dictionary == "basic":
-        return basic_servo_positions.get(gesture_name, [90, 90, 90, 90, 90, 90])
-    elif dictionary == "tsl":
-        return tsl_servo_positions.get(gesture_name, [90, 90, 90, 90, 90, 90])
-    else:
-        return [90, 90, 90, 90, 90, 90]  # Default neutral position
+    return _SERVO_REGISTRY.get(dictionary, _EMPTY).get(gesture_name, _DEFAULT_POS)
 
 def get_all_gestures(dictionary: str = "basic") -> dict:
     """
@@ -155,14 +164,7 @@ def get_all_gestures(dictionary: str = "basic") -> dict:
     Returns:
         Dictionary of gesture names and IDs
     """
-    if dictionary == "basic":
-        return basic_gesture_dict
-    elif dictionary == "tsl":
-        return tsl_alphabet_dict
-    elif dictionary == "extended":
-        return extended_gesture_dict
-    else:
-        return {}
+    return _GESTURE_REGISTRY.get(dictionary, {})
 
 # Export for C header generation
 def export_gesture_map_to_c(filepath: str, dictionary: str = "basic"):
@@ -174,35 +176,32 @@ def export_gesture_map_to_c(filepath: str, dictionary: str = "basic"):
         dictionary: Which dictionary to export
     """
     gestures = get_all_gestures(dictionary)
+    positions = _SERVO_REGISTRY.get(dictionary, _EMPTY)
+    items = sorted(gestures.items(), key=lambda x: x[1])
     
-    with open(filepath, 'w') as f:
-        f.write("// Auto-generated gesture mappings\n")
-        f.write("#ifndef GESTURE_MAP_H\n")
-        f.write("#define GESTURE_MAP_H\n\n")
-        
-        # Write gesture IDs
-        f.write("// Gesture IDs\n")
-        for name, id in gestures.items():
-            f.write(f"#define GESTURE_{name.upper()} {id}\n")
-        
-        f.write(f"\n#define NUM_GESTURES {len(gestures)}\n\n")
-        
-        # Write servo positions
-        f.write("// Servo positions for each gesture\n")
-        f.write("const uint8_t gesture_servo_positions[NUM_GESTURES][6] = {\n")
-        
-        positions = basic_servo_positions if dictionary == "basic" else tsl_servo_positions
-        for name, id in sorted(gestures.items(), key=lambda x: x[1]):
-            pos = positions.get(name, [90, 90, 90, 90, 90, 90])
-            f.write(f"    {{{pos[0]}, {pos[1]}, {pos[2]}, {pos[3]}, {pos[4]}, {pos[5]}}}, // {name}\n")
-        
-        f.write("};\n\n")
-        
-        # Write gesture names
-        f.write("// Gesture names\n")
-        f.write("const char* gesture_names[NUM_GESTURES] = {\n")
-        for name, id in sorted(gestures.items(), key=lambda x: x[1]):
-            f.write(f'    "{name}",\n')
-        f.write("};\n\n")
-        
-        f.write("#endif // GESTURE_MAP_H\n")
\ No newline at end of file
+    # Gesture IDs, servo positions and names, one line per gesture
+    id_lines = "\n".join(f"#define GESTURE_{name.upper()} {id}" for name, id in items)
+    pos_lines = "\n".join(f"    {{{', '.join(map(str, positions.get(name, _DEFAULT_POS)))}}}, // {name}"
+                          for name, _ in items)
+    name_lines = "\n".join(f'    "{name}",' for name, _ in items)
+    
+    header = (
+        "// Auto-generated gesture mappings\n"
+        "#ifndef GESTURE_MAP_H\n"
+        "#define GESTURE_MAP_H\n\n"
+        "// Gesture IDs\n"
+        f"{id_lines}\n"
+        f"\n#define NUM_GESTURES {len(gestures)}\n\n"
+        "// Servo positions for each gesture\n"
+        "const uint8_t gesture_servo_positions[NUM_GESTURES][6] = {\n"
+        f"{pos_lines}\n"
+        "};\n\n"
+        "// Gesture names\n"
+        "const char* gesture_names[NUM_GESTURES] = {\n"
+        f"{name_lines}\n"
+        "};\n\n"
+        "#endif // GESTURE_MAP_H\n"
+    )
+    
+    with open(filepath, 'w', buffering=1 << 20) as f:
+        f.write(header)